@@ -6,11 +6,14 @@
  *          global comparativo (datos vs modelo) a partir de un registro CSV.
  *
  * El programa:
- *   - Lee un archivo CSV con tiempo, PWM y RPM de un ensayo de barrido.
+ *   - Lee un archivo CSV con tiempo, PWM y RPM de un ensayo de barrido (o
+ *     convierte antes a CSV un registro binario @c .bin del RP2040).
  *   - Detecta los escalones de PWM (subidas y bajadas) en la señal medida.
  *   - Elimina valores atípicos mediante la prueba de Hampel.
  *   - Ajusta, por mínimos cuadrados no‑lineales, un modelo FOPDT a cada tramo.
- *   - Genera gráficos PNG individuales por tramo con la curva medida y el modelo.
+ *   - Guarda los parámetros ajustados de cada tramo en un CSV.
+ *   - Genera gráficos PNG individuales por tramo con la curva medida y el modelo
+ *     (se omiten con la opción --no-plot).
  *   - Construye y guarda un gráfico global (todas las curvas) para validar el
  *     modelo completo.
  *
@@ -20,36 +23,141 @@
  */
 """
 
-import sys, os
+import argparse, os, math
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+from scipy.ndimage import median_filter
+from scipy.optimize import least_squares
+
+try:  # Numba es opcional: sin él se usa la versión NumPy de los núcleos
+    from numba import njit, types as nbt
+except ImportError:
+    njit = None
+
+DPI = int(os.environ.get('FOPDT_DPI', 150))  #: Resolución de los PNG generados
+
+#: Tipos explícitos de las columnas conocidas (evita la inferencia al leer)
+CSV_DTYPES = {'Tiempo_ms': 'float64', 'timestamp_us': 'float64',
+              'PWM_porcentaje': 'float64', 'RPM': 'float64'}
+
+#: Registro binario del RP2040 (``ustruct`` "<IBH"): tiempo [ms], PWM [%], RPM
+REGISTRO_BIN = np.dtype([('t', '<u4'), ('pwm', 'u1'), ('rpm', '<u2')])
 
 # -----------------------------------------------------------------------------
 # Funciones utilitarias                                                         
 # -----------------------------------------------------------------------------
 
-def hampel(series: pd.Series, window_size: int = 7, n_sigmas: float = 3.0) -> pd.Series:
+def leer_csv(csv_file: str) -> pd.DataFrame:
+    """!
+    Lee el registro CSV con el motor PyArrow (multihilo) si está disponible;
+    en caso contrario usa el motor C. En ambos casos con tipos explícitos.
+
+    @param csv_file  Ruta del archivo CSV.
+    @return          DataFrame con los datos del ensayo.
+    """
+    try:
+        return pd.read_csv(csv_file, engine='pyarrow', dtype=CSV_DTYPES)
+    except ImportError:
+        return pd.read_csv(csv_file, dtype=CSV_DTYPES)
+
+
+def convertir_bin(bin_file: str) -> str:
+    """!
+    Convierte un registro binario del RP2040 (registros @c REGISTRO_BIN) al
+    CSV equivalente, con formateo vectorizado de NumPy.
+
+    @param bin_file  Ruta del archivo @c .bin.
+    @return          Ruta del CSV generado (misma ruta con extensión @c .csv).
+    """
+    a = np.fromfile(bin_file, dtype=REGISTRO_BIN)
+    csv_file = os.path.splitext(bin_file)[0] + '.csv'
+    np.savetxt(csv_file, np.column_stack((a['t'], a['pwm'], a['rpm'])),
+               fmt='%d', delimiter=',', header='Tiempo_ms,PWM_porcentaje,RPM',
+               comments='')
+    return csv_file
+
+
+def _mediana_movil(x: np.ndarray, window_size: int) -> np.ndarray:
+    """!
+    Mediana móvil centrada sobre un arreglo NumPy.
+
+    @param x             Señal de entrada (ndarray 1‑D).
+    @param window_size   Tamaño de la ventana deslizante (impar).
+    @return Arreglo del mismo tamaño que @p x; las posiciones sin ventana
+            completa (bordes) quedan en NaN.
+    """
+    med = np.full(x.size, np.nan)
+    if x.size >= window_size:
+        interior = slice(window_size // 2, x.size - window_size // 2)
+        med[interior] = median_filter(x, size=window_size, mode='nearest')[interior]
+    return med
+
+
+def hampel(y: np.ndarray, window_size: int = 7, n_sigmas: float = 3.0) -> np.ndarray:
     """!
     Identifica valores atípicos usando el filtro de Hampel.
 
-    @param series        Señal de entrada (Series de Pandas).
+    @param y             Señal de entrada (ndarray 1‑D).
     @param window_size   Tamaño de la ventana deslizante (número de muestras).
     @param n_sigmas      Multiplicador del MAD (desviación absoluta mediana)
                          para definir el umbral.
-    @return Serie booleana donde *True* indica un outlier.
+    @return Arreglo booleano donde *True* indica un outlier.
     """
     k = 1.4826  # factor para aproximar la desviación estándar
-    med_rolling = series.rolling(window_size, center=True).median()
-    diff = np.abs(series - med_rolling)
-    mad = k * diff.rolling(window_size, center=True).median()
-    return (diff > n_sigmas * mad).fillna(False)
+    y = np.asarray(y, dtype=np.float64)
+    diff = np.abs(y - _mediana_movil(y, window_size))
+    # La MAD sólo se calcula donde diff es válida (sin los NaN de los bordes)
+    interior = slice(window_size // 2, y.size - window_size // 2)
+    mad = np.full(y.size, np.nan)
+    mad[interior] = k * _mediana_movil(diff[interior], window_size)
+    with np.errstate(invalid='ignore'):
+        return diff > n_sigmas * mad  # NaN (bordes) ⇒ False
 
 # -----------------------------------------------------------------------------
 # Modelo FOPDT                                                                  
 # -----------------------------------------------------------------------------
 
+#: Banderas LLVM de los núcleos: permiten vectorizar math.exp (SVML/libmvec)
+_FASTMATH = {'nnan', 'ninf', 'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+# Con firmas explícitas los núcleos se compilan al importar el módulo (y
+# cache=True los guarda en disco), así el primer tramo no paga el JIT.
+# El vector de tiempos sólo se lee: se compila también la variante de sólo
+# lectura, que es lo que devuelven Series.to_numpy() / np.ascontiguousarray
+# sobre columnas de pandas (copy-on-write).
+if njit is not None:
+    _T_SIGS = (nbt.float64[::1], nbt.Array(nbt.float64, 1, 'C', readonly=True))
+
+    @njit([nbt.void(t_, nbt.float64[::1], nbt.float64, nbt.float64, nbt.float64,
+                    nbt.float64, nbt.float64) for t_ in _T_SIGS],
+          cache=True, fastmath=_FASTMATH)
+    def _step_response_kernel(t, out, K, tau, theta, y0, du):
+        """!
+        Núcleo compilado de la respuesta FOPDT: escribe y(t) en @p out.
+        """
+        for i in range(t.size):
+            if t[i] < theta:
+                out[i] = y0
+            else:
+                out[i] = y0 + K * du * (1.0 - math.exp(-(t[i] - theta) / tau))
+
+    @njit([nbt.void(t_, nbt.float64[::1], nbt.float64, nbt.float64) for t_ in _T_SIGS],
+          cache=True, fastmath=_FASTMATH)
+    def _exp_kernel(t, out, tau, theta):
+        """!
+        Núcleo compilado del término exp(-(t-θ)/τ); vale 1 durante el retardo.
+        """
+        for i in range(t.size):
+            if t[i] < theta:
+                out[i] = 1.0
+            else:
+                out[i] = math.exp(-(t[i] - theta) / tau)
+else:
+    _step_response_kernel = None
+    _exp_kernel = None
+
+
 def step_response(t, K: float, tau: float, theta: float, y0: float, du: float):
     """!
     Función de transferencia FOPDT en el dominio del tiempo.
@@ -62,29 +170,92 @@ def step_response(t, K: float, tau: float, theta: float, y0: float, du: float):
     @param du     Cambio en la entrada PWM (Δu).
     @return       Respuesta y(t) del sistema.
     """
-    t = np.asarray(t)
-    return np.where(t < theta,
-                    y0,
-                    y0 + K * du * (1 - np.exp(-(t - theta) / tau)))
+    t = np.ascontiguousarray(t, dtype=np.float64)
+    if _step_response_kernel is not None:
+        out = np.empty_like(t)
+        _step_response_kernel(t, out, float(K), float(tau), float(theta),
+                              float(y0), float(du))
+        return out
+    # exp sólo fuera del retardo: evita cálculos descartados y desbordes
+    out = np.full_like(t, y0)
+    idx = t >= theta
+    out[idx] = y0 + K * du * (1.0 - np.exp(-(t[idx] - theta) / tau))
+    return out
 
 
-def ajustar_fopdt(t: pd.Series, y: pd.Series, y0: float, du: float):
+class _FOPDTModel:
     """!
-    Ajusta un modelo FOPDT a los datos de un tramo mediante *curve_fit*.
+    Residuo y Jacobiano analítico del FOPDT para un tramo fijo.
+
+    Ambos necesitan e = exp(-(t-θ)/τ) con los mismos parámetros y el
+    optimizador los pide uno tras otro, así que el último término calculado
+    se guarda y se reutiliza mientras (τ, θ) no cambien.
+    """
+
+    def __init__(self, t: np.ndarray, y: np.ndarray, y0: float, du: float):
+        self.t, self.y, self.y0, self.du = t, y, y0, du
+        self._cache_key = None
+        self._cached_e = np.empty_like(t)
+
+    def _exp(self, tau: float, theta: float) -> np.ndarray:
+        """!
+        Término exponencial (1 durante el retardo), calculado una vez por (τ, θ).
+        """
+        if (tau, theta) != self._cache_key:
+            if _exp_kernel is not None:
+                _exp_kernel(self.t, self._cached_e, float(tau), float(theta))
+            else:
+                np.exp(-np.maximum(self.t - theta, 0.0) / tau, out=self._cached_e)
+            self._cache_key = (tau, theta)
+        return self._cached_e
+
+    def residuo(self, p) -> np.ndarray:
+        """!
+        Residuo modelo − medida para p = (K, τ, θ).
+        """
+        K, tau, theta = p
+        return self.y0 + K * self.du * (1.0 - self._exp(tau, theta)) - self.y
+
+    def jac(self, p) -> np.ndarray:
+        """!
+        Matriz (n, 3) con ∂y/∂K, ∂y/∂τ y ∂y/∂θ; nula para t < θ.
+        """
+        K, tau, theta = p
+        e = self._exp(tau, theta)
+        dt = np.maximum(self.t - theta, 0.0)
+        jac = np.empty((self.t.size, 3))
+        jac[:, 0] = self.du * (1.0 - e)
+        jac[:, 1] = -K * self.du * e * dt / tau**2
+        jac[:, 2] = np.where(self.t >= theta, -K * self.du * e / tau, 0.0)
+        return jac
+
+
+def ajustar_fopdt(t: np.ndarray, y: np.ndarray, y0: float, du: float):
+    """!
+    Ajusta un modelo FOPDT a los datos de un tramo mediante *least_squares*.
 
     @param t   Tiempo relativo (s) del tramo.
     @param y   Señal de salida (RPM) medida.
     @param y0  Nivel inicial de y.
     @param du  Cambio de entrada PWM.
-    @return    Tupla (K, tau, theta) del modelo ajustado.
+    @return    Tupla (popt, rmse, y_fit): parámetros (K, tau, theta), error
+               cuadrático medio y modelo evaluado en @p t, tomados de los
+               residuos finales del ajuste.
+    @throws RuntimeError  Si el ajuste no converge.
     """
-    K0 = (y.iloc[-1] - y0) / du if du else 1.0
-    tau0 = max((t.iloc[-1] - t.iloc[0]) / 3.0, 0.05)
-    popt, _ = curve_fit(lambda t_, K, tau, theta: step_response(t_, K, tau, theta, y0, du),
-                        t, y, p0=[K0, tau0, 0],
-                        bounds=([-np.inf, 1e-3, 0], [np.inf, np.inf, t.iloc[-1]]),
-                        method='trf', loss='soft_l1')
-    return popt  # (K, tau, theta)
+    t = np.ascontiguousarray(t, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    K0 = (y[-1] - y0) / du if du else 1.0
+    tau0 = max((t[-1] - t[0]) / 3.0, 0.05)
+    modelo = _FOPDTModel(t, y, y0, du)
+    res = least_squares(modelo.residuo, [K0, tau0, 0], jac=modelo.jac,
+                        bounds=([-np.inf, 1e-3, 0], [np.inf, np.inf, t[-1]]),
+                        method='trf', loss='soft_l1', x_scale='jac')
+    if not res.success:
+        raise RuntimeError("Optimal parameters not found: " + res.message)
+    rmse = np.sqrt(np.mean(res.fun**2))
+    return res.x, rmse, y + res.fun
+
 
 # -----------------------------------------------------------------------------
 # Detección de escalones                                                        
@@ -96,12 +267,12 @@ def detectar_escalones(df: pd.DataFrame, pwm_col: str):
 
     @param df        DataFrame con los datos originales.
     @param pwm_col   Nombre de la columna PWM.
-    @return          Lista de tuplas (idx_ini, idx_fin) por tramo.
+    @return          Arreglo (n, 2) con los pares (idx_ini, idx_fin) por tramo.
     """
-    cambio = df[pwm_col].diff().fillna(0) != 0
-    pasos = np.where(cambio)[0]
-    pasos = np.append(pasos, len(df))
-    return [(pasos[i], pasos[i+1]) for i in range(len(pasos)-1)]
+    pwm = df[pwm_col].to_numpy()
+    pasos = np.flatnonzero(pwm[1:] != pwm[:-1]) + 1
+    pasos = np.append(pasos, pwm.size)
+    return np.column_stack((pasos[:-1], pasos[1:]))
 
 # -----------------------------------------------------------------------------
 # Programa principal                                                            
@@ -109,107 +280,171 @@ def detectar_escalones(df: pd.DataFrame, pwm_col: str):
 
 def main() -> None:
     """!
-    Punto de entrada. Procesa el CSV, ajusta tramo a tramo y genera gráficos.
+    Punto de entrada. Procesa el CSV, ajusta tramo a tramo, guarda los
+    parámetros en CSV y, salvo con @c --no-plot, genera los gráficos.
     """
-    csv_file = sys.argv[1] if len(sys.argv) > 1 else input("Nombre del CSV: ")
-    df = pd.read_csv(csv_file)
+    parser = argparse.ArgumentParser(description="Ajuste FOPDT por escalones de un ensayo PWM/RPM.")
+    parser.add_argument('csv', nargs='?', help="Archivo CSV (o .bin del RP2040) del ensayo.")
+    parser.add_argument('--no-plot', dest='plot', action='store_false',
+                        help="No genera gráficos (ni importa matplotlib).")
+    parser.add_argument('--out-params', default=os.path.join('Salida Mpy', 'parametros_mpy.csv'),
+                        help="CSV de salida con los parámetros ajustados por tramo.")
+    args = parser.parse_args()
+
+    if args.plot:
+        import matplotlib
+        matplotlib.use('Agg')  # sólo se guardan PNG: backend sin GUI
+        import matplotlib.pyplot as plt
+
+    csv_file = args.csv or input("Nombre del CSV: ")
+    if csv_file.lower().endswith('.bin'):
+        csv_file = convertir_bin(csv_file)
+    df = leer_csv(csv_file)
 
     # --------------------------- Selección de columnas -----------------------
     time_col = ('Tiempo_ms' if 'Tiempo_ms' in df.columns else
                 'timestamp_us' if 'timestamp_us' in df.columns else df.columns[0])
-    if time_col == 'timestamp_us':
-        df['Tiempo_ms'] = df['timestamp_us'] / 1000.0
-        time_col = 'Tiempo_ms'
+    escala_s = 1e-6 if time_col == 'timestamp_us' else 1e-3  # unidad → s
 
     pwm_col = 'PWM_porcentaje' if 'PWM_porcentaje' in df.columns else df.columns[1]
     rpm_col = 'RPM' if 'RPM' in df.columns else df.columns[2]
 
-    # Normaliza tiempo absoluto a segundos desde inicio
-    df['t_s'] = (df[time_col] - df[time_col].iloc[0]) / 1000.0
+    # Columnas como arreglos float64 contiguos (SoA); los tramos son vistas.
+    # Se copian: sin copia serían vistas del bloque del DataFrame y lo
+    # mantendrían vivo. El tiempo se normaliza en sitio a segundos.
+    t_arr   = df[time_col].to_numpy(np.float64, copy=True)
+    t_arr  -= t_arr[0]
+    np.multiply(t_arr, escala_s, out=t_arr)
+    y_arr   = df[rpm_col].to_numpy(np.float64, copy=True)
+    pwm_arr = df[pwm_col].to_numpy(np.float64, copy=True)
+    tramos  = detectar_escalones(df, pwm_col)
+    del df  # en adelante sólo se usan los tres arreglos (libera el bloque)
+
+    # Filtro Hampel en una sola pasada sobre toda la señal; cada tramo
+    # usa luego su porción de la máscara.
+    atipicos = hampel(y_arr, 7, 3.0)
 
-    tramos = detectar_escalones(df, pwm_col)
     resultados = []  # Acumula parámetros para la curva global
 
-    # --------------------------- Procesamiento por tramo --------------------
+    # --------------------------- Preparación por tramo ----------------------
+    candidatos = []  # Tramos válidos, en orden, listos para ajustar
     for idx_start, idx_end in tramos:
-        seg = df.iloc[idx_start:idx_end].copy()
-        if len(seg) < 8:
+        if idx_end - idx_start < 8:
             continue  # tramo demasiado corto
 
-        pwm_new  = seg[pwm_col].iloc[0]
-        pwm_prev = df[pwm_col].iloc[idx_start-1] if idx_start > 0 else pwm_new
+        pwm_new  = pwm_arr[idx_start]
+        pwm_prev = pwm_arr[idx_start-1] if idx_start > 0 else pwm_new
         du = pwm_new - pwm_prev
         if du == 0:
             continue  # sin cambio
 
-        direccion = 'subida' if du > 0 else 'bajada'
-        t_rel = seg['t_s'] - seg['t_s'].iloc[0]
-        y     = seg[rpm_col]
-        y0    = y.iloc[0]
+        t_rel = t_arr[idx_start:idx_end] - t_arr[idx_start]
+        y     = y_arr[idx_start:idx_end]
 
         # ---- filtro Hampel ---------------------------------------------------
-        mask = ~hampel(y, 7, 3.0)
-        t_clean, y_clean = t_rel[mask], y[mask]
-        if len(y_clean) < 5:
-            print(f"[WARN] Tramo PWM {pwm_prev}->{pwm_new}% sin datos suficientes.")
+        mask = ~atipicos[idx_start:idx_end]
+        if np.count_nonzero(mask) < 5:
+            print(f"[WARN] Tramo PWM {pwm_prev:.0f}->{pwm_new:.0f}% sin datos suficientes.")
             continue
 
+        candidatos.append({
+            'idx_start': idx_start, 'idx_end': idx_end,
+            'pwm_prev': pwm_prev, 'pwm_new': pwm_new,
+            'direccion': 'subida' if du > 0 else 'bajada',
+            't_rel': t_rel, 'y': y, 'mask': mask,
+            'y0': y[0], 'du': du
+        })
+
+    # --------------------------- Ajuste en paralelo --------------------------
+    # Cada ajuste es independiente: se reparten entre procesos y sólo viajan
+    # los arreglos del tramo, no el DataFrame completo.
+    with ProcessPoolExecutor() as pool:
+        futuros = [pool.submit(ajustar_fopdt, c['t_rel'][c['mask']], c['y'][c['mask']],
+                               c['y0'], c['du'])
+                   for c in candidatos]
+
+    # --------------------------- Procesamiento por tramo --------------------
+    # Una sola figura reutilizada para todos los tramos
+    if args.plot:
+        os.makedirs('Salida Mpy', exist_ok=True)
+        fig, ax = plt.subplots(figsize=(8,4))
+    for c, futuro in zip(candidatos, futuros):
+        pwm_prev, pwm_new, direccion = c['pwm_prev'], c['pwm_new'], c['direccion']
+        y0, du = c['y0'], c['du']
         try:
-            K, tau, theta = ajustar_fopdt(t_clean, y_clean, y0, du)
+            (K, tau, theta), rmse, _ = futuro.result()
         except RuntimeError:
-            print(f"[ERR] No converge PWM {pwm_new}% ({direccion}). Omitido.")
+            print(f"[ERR] No converge PWM {pwm_new:.0f}% ({direccion}). Omitido.")
             continue
 
-        t_seg = t_rel
-        y_mod = step_response(t_seg, K, tau, theta, y0, du)
-
         # ---- gráfico individual ---------------------------------------------
-        rmse = np.sqrt(np.mean((y_clean - step_response(t_clean, K, tau, theta, y0, du))**2))
-        plt.figure(figsize=(8,4))
-        plt.plot(t_clean, y_clean, '.', label='Medido')
-        plt.plot(t_seg, y_mod, '-', label=f'Modelo; K={K:.2f}, τ={tau:.2f}s, θ={theta:.2f}s')
-        plt.text(0.02, 0.95, f'RMSE={rmse:.1f} RPM', transform=plt.gca().transAxes,
-                 ha='left', va='top', bbox=dict(fc='white', alpha=0.75, ec='none'))
-        plt.title(f'PWM {pwm_prev:.0f}→{pwm_new:.0f}% ({direccion})')
-        plt.xlabel('Tiempo [s]'); plt.ylabel('RPM')
-        plt.grid(); plt.legend(); plt.tight_layout()
-        fname = os.path.join('Salida Mpy', f"pwm_{int(pwm_new)}_{direccion}_mpy.png")
-        os.makedirs('Salida Mpy', exist_ok=True)
-        plt.savefig(fname, dpi=150); plt.close()
-        print(f"[OK] Guardado: {fname}")
+        if args.plot:
+            t_seg = c['t_rel']
+            y_mod = step_response(t_seg, K, tau, theta, y0, du)
+            t_clean, y_clean = t_seg[c['mask']], c['y'][c['mask']]
+
+            ax.clear()
+            ax.plot(t_clean, y_clean, '.', label='Medido')
+            ax.plot(t_seg, y_mod, '-', label=f'Modelo; K={K:.2f}, τ={tau:.2f}s, θ={theta:.2f}s')
+            ax.text(0.02, 0.95, f'RMSE={rmse:.1f} RPM', transform=ax.transAxes,
+                    ha='left', va='top', bbox=dict(fc='white', alpha=0.75, ec='none'))
+            ax.set_title(f'PWM {pwm_prev:.0f}→{pwm_new:.0f}% ({direccion})')
+            ax.set_xlabel('Tiempo [s]'); ax.set_ylabel('RPM')
+            ax.grid(); ax.legend(); fig.tight_layout()
+            fname = os.path.join('Salida Mpy', f"pwm_{int(pwm_new)}_{direccion}_mpy.png")
+            fig.savefig(fname, dpi=DPI)
+            print(f"[OK] Guardado: {fname}")
 
         # ---- guardar parámetros para curva global ---------------------------
         resultados.append({
-            'slice': slice(idx_start, idx_end),
-            'K': K, 'tau': tau, 'theta': theta,
+            'pwm_prev': pwm_prev, 'pwm_new': pwm_new, 'direccion': direccion,
+            'K': K, 'tau': tau, 'theta': theta, 'rmse': rmse,
             'y0': y0, 'du': du,
-            't0': df['t_s'].iloc[idx_start]
+            't0': t_arr[c['idx_start']],
+            'idx_start': c['idx_start'], 'idx_end': c['idx_end']
         })
+    if args.plot:
+        plt.close(fig)
+
+    # --------------------------- Parámetros ----------------------------------
+    os.makedirs(os.path.dirname(args.out_params) or '.', exist_ok=True)
+    pd.DataFrame(resultados).to_csv(args.out_params, index=False)
+    print(f"[OK] Parámetros guardados: {args.out_params}")
 
     # --------------------------- Gráfico global ------------------------------
+    if not args.plot:
+        return
     if resultados:
-        y_model_global = np.full(len(df), np.nan)
+        y_model_global = np.full(t_arr.size, np.nan)
         for r in resultados:
-            idx = r['slice']
-            t_seg_abs = df['t_s'].iloc[idx] - r['t0']     # tiempo relativo tramo
-            y_model_global[idx] = step_response(t_seg_abs,
-                                                r['K'], r['tau'], r['theta'],
-                                                r['y0'], r['du'])
+            sl = slice(r['idx_start'], r['idx_end'])
+            y_model_global[sl] = step_response(t_arr[sl] - r['t0'],   # tiempo relativo tramo
+                                               r['K'], r['tau'], r['theta'],
+                                               r['y0'], r['du'])
 
         # puede haber pequeñas zonas NaN (tramos demasiado cortos / descartados)
-        # --> sustituirlas por interpolación lineal para la gráfica
-        y_model_interp = pd.Series(y_model_global).interpolate(method='linear')
+        # --> son justo los huecos entre tramos registrados: se unen sus
+        # extremos linealmente para la gráfica (los NaN previos al primer
+        # tramo se dejan tal cual; tras el último se mantiene su valor final)
+        y_model_interp = y_model_global
+        for r_a, r_b in zip(resultados, resultados[1:]):
+            a, b = r_a['idx_end'], r_b['idx_start']
+            if a < b:
+                y_model_interp[a:b] = np.linspace(y_model_interp[a-1], y_model_interp[b],
+                                                  b - a + 2)[1:-1]
+        fin = resultados[-1]['idx_end']
+        y_model_interp[fin:] = y_model_interp[fin-1]
 
         # ---- gráfico global ------------------------------------------------------
         plt.figure(figsize=(10,5))
-        plt.plot(df['t_s'], df[rpm_col], '.', markersize=2, label='Medido')
-        plt.plot(df['t_s'], y_model_interp, '-', linewidth=1.2, label='Modelo global')
+        plt.plot(t_arr, y_arr, '.', markersize=2, label='Medido')
+        plt.plot(t_arr, y_model_interp, '-', linewidth=1.2, label='Modelo global')
         plt.title('Respuesta completa del sistema (medición vs modelo FOPDT)')
         plt.xlabel('Tiempo [s]'); plt.ylabel('RPM'); plt.grid(); plt.legend()
         plt.ylim(0, 8000)  # Limitar el eje y a un máximo de 8000
         plt.tight_layout()
         global_name = "Salida Mpy/pwm_global_mpy.png"
-        plt.savefig(global_name, dpi=150); plt.close()
+        plt.savefig(global_name, dpi=DPI); plt.close()
         print(f"[OK] Gráfico global guardado: {global_name}")
     else:
         print("[INFO] No se generó gráfico global (sin tramos válidos).")
@@ -7,8 +7,10 @@
  *
  * El script:
  *   - Configura un pin PWM para excitar el motor a 100 kHz.
- *   - Usa interrupciones para medir el número de ranuras del encoder que
- *     pasan por el sensor y convertir dicho conteo en RPM cada 4 ms.
+ *   - Cuenta con una máquina de estados PIO las ranuras del encoder que
+ *     pasan por el sensor; un temporizador de hardware toma la cuenta cada
+ *     4 ms y la deja, con su instante real, en un búfer circular que un hilo
+ *     del núcleo 1 vuelca.
  *   - Recorre automáticamente un barrido de ciclos de trabajo de 0 → 100 % y
  *     vuelve a 0 % para capturar la curva de respuesta del motor.
  *   - Almacena las tripletas {tiempo [ms], PWM [%], RPM} en un archivo CSV.
@@ -18,116 +20,285 @@
  */
 """
 
-from machine import Pin, PWM
+from machine import Timer
+from array import array
+import rp2
 import time
+import _thread
+import gc
+import ustruct
+from micropython import const
+
+from encoder_common import (ENCODER_HUECOS, CABECERA_CSV, EscritorBloques,
+                            pwm_pin, sensor_pin, DUTY, linea, mv_linea, itoa,
+                            barrido)
 
 # -----------------------------------------------------------------------------
 # Parámetros de configuración                                                  
 # -----------------------------------------------------------------------------
 
-ENCODER_HUECOS = 20          #: Número de ranuras/reflectores del disco encoder
 TIEMPO_ENTRE_PASOS = 2000    #: Duración de cada escalón PWM [ms]
 MEDICION_INTERVALO_MS = 4    #: Período de cálculo de RPM [ms]
-PASOS_PWM = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]  #: Secuencia de ciclos de trabajo [%]
-ARCHIVO = "datos.csv"        #: Nombre del archivo de salida en la flash
+RPM_US_POR_CUENTA = 60_000_000 // ENCODER_HUECOS  #: RPM·µs por flanco (3 000 000 / ventana)
+TAM_BUFFER = 1024            #: Muestras del anillo del temporizador (potencia de 2)
+PIO_FREQ_HZ = 1_000_000      #: Reloj del contador PIO: 1 ciclo = 1 µs
+# const(): el compilador lo sustituye como literal; @rp2.asm_pio ensambla con
+# un espacio de nombres que sólo contiene las instrucciones PIO.
+PIO_FILTRO_CICLOS = const(4)  #: Duración mínima de un nivel válido [ciclos PIO]
+PASO_PWM = 10                #: Incremento entre escalones del barrido [%]
+FORMATO_BINARIO = False      #: True → registros binarios "<IBH" (7 B) en vez de CSV
+ARCHIVO = "datos.bin" if FORMATO_BINARIO else "datos.csv"  #: Archivo de salida en la flash
+
+# -----------------------------------------------------------------------------
+# Contador PIO de flancos                                                      
+# -----------------------------------------------------------------------------
+
+
+@rp2.asm_pio()
+def _pio_contador():
+    """!
+    Programa PIO que cuenta flancos de bajada del sensor.
+
+    Cada ranura del encoder (alto → bajo) decrementa el registro X, que se
+    inicializa en 0xFFFFFFFF; así ~X es el número de flancos contados. La
+    CPU no atiende ninguna interrupción por flanco.
+
+    Cada nivel se vuelve a muestrear tras ``PIO_FILTRO_CICLOS`` ciclos; los
+    pulsos más cortos se descartan como glitches sin llegar a contarse.
+    """
+    label("bucle")
+    wait(1, pin, 0)[PIO_FILTRO_CICLOS - 1]
+    jmp(pin, "alto")                # Sigue en alto: subida válida
+    jmp("bucle")                    # Glitch en alto: se ignora
+    label("alto")
+    wait(0, pin, 0)[PIO_FILTRO_CICLOS - 1]
+    jmp(pin, "alto")                # Volvió a alto: bajada espuria
+    jmp(x_dec, "bucle")
+
+
+# Instrucciones precodificadas que la CPU inyecta para leer/reiniciar X
+_PIO_LEER_X  = rp2.asm_pio_encode("mov(isr, invert(x))", 0)
+_PIO_PUSH    = rp2.asm_pio_encode("push(noblock)", 0)
+_PIO_RESET_X = rp2.asm_pio_encode("mov(x, invert(null))", 0)
+
+contador_sm = rp2.StateMachine(0, _pio_contador, freq=PIO_FREQ_HZ,
+                               in_base=sensor_pin, jmp_pin=sensor_pin)
+contador_sm.exec(_PIO_RESET_X)
+contador_sm.active(1)
+
+
+def leer_cuenta() -> int:
+    """!
+    Lee y reinicia el contador PIO de flancos.
+
+    @return Flancos contados desde la lectura anterior.
+    """
+    contador_sm.exec(_PIO_LEER_X)    # ISR ← ~X (flancos desde el último reinicio)
+    contador_sm.exec(_PIO_PUSH)
+    contador_sm.exec(_PIO_RESET_X)   # Reinicia la cuenta para la siguiente ventana
+    return contador_sm.get()
+
+
+def calcular_rpm(cuenta: int, ventana_us: int) -> int:
+    """!
+    Calcula las revoluciones por minuto (RPM) a partir de los pulsos
+    acumulados en una ventana de muestreo, sólo con aritmética entera.
+
+    Se usa la duración medida de la ventana y no la nominal de 4 ms: si la
+    ISR se retrasa (p. ej. mientras se programa la flash), la ventana es más
+    larga y la cuenta mayor, y la RPM sigue siendo correcta.
+
+    @param cuenta      Flancos contados en la ventana.
+    @param ventana_us  Duración real de la ventana [µs].
+    @return Velocidad media del eje en la ventana, en RPM (redondeada).
+    """
+    if ventana_us <= 0:
+        return 0
+    return (cuenta * RPM_US_POR_CUENTA + ventana_us // 2) // ventana_us
+
 
 # -----------------------------------------------------------------------------
-# Variables de estado                                                          
+# Muestreo por temporizador                                                    
 # -----------------------------------------------------------------------------
 
-contador = 0                 #: Contador global de flancos detectados por el encoder
+_cuentas = array('i', [0] * TAM_BUFFER)  #: Anillo de cuentas escrito por la ISR
+_marcas = array('i', [0] * TAM_BUFFER)   #: Instante real de cada muestra (ticks_us)
+_pwms = bytearray(TAM_BUFFER)            #: PWM [%] vigente en cada muestra del anillo
+_t_anterior_us = 0                       #: Instante de la muestra anterior (ticks_us)
+_transcurrido_us = 0                     #: Tiempo desde el inicio hasta la última muestra volcada [µs]
+_n_muestras = 0                          #: Muestras escritas por la ISR (no se envuelve)
+_n_leidas = 0                            #: Muestras ya volcadas al CSV
+pwm_actual = 0                           #: Ciclo de trabajo aplicado [%]
+
+
+def _on_sample_tick(tmr) -> None:
+    """!
+    ISR del temporizador: guarda la cuenta de la ventana, el instante en que
+    se cerró y el PWM vigente en el anillo.
+
+    No reserva memoria ni imprime (``ticks_us`` devuelve un entero pequeño),
+    por lo que es segura en modo ``hard``.
+    """
+    global _n_muestras
+    i = _n_muestras & (TAM_BUFFER - 1)
+    _cuentas[i] = leer_cuenta()
+    _marcas[i] = time.ticks_us()
+    _pwms[i] = pwm_actual
+    _n_muestras += 1
+
 
 # -----------------------------------------------------------------------------
-# Inicialización de hardware                                                   
+# Formato CSV sin asignaciones                                                 
 # -----------------------------------------------------------------------------
 
-pwm_pin = PWM(Pin(3))        # Pin PWM conectado al puente H / transistor de potencia
-pwm_pin.freq(100_000)        # Frecuencia PWM de 100 kHz
+def escribir_fila(f, marca: int, pwm: int, rpm: int) -> None:
+    """!
+    Compone la fila ``marca,pwm,rpm\n`` en el búfer compartido y la escribe.
 
-sensor_pin = Pin(5, Pin.IN, Pin.PULL_UP)  # Pin de entrada conectado al fotointerruptor
+    @param f      Archivo CSV abierto.
+    @param marca  Marca de tiempo [ms].
+    @param pwm    Ciclo de trabajo [%].
+    @param rpm    Velocidad [RPM] (entera).
+    """
+    n = itoa(linea, 0, marca)
+    linea[n] = 44                    # ','
+    n = itoa(linea, n + 1, pwm)
+    linea[n] = 44
+    n = itoa(linea, n + 1, rpm)
+    linea[n] = 10                    # '\n'
+    f.write(mv_linea[:n + 1])
+
+
+_registro = bytearray(7)       #: Búfer reutilizado para un registro binario
 
 
-def incrementar_contador(pin: Pin) -> None:
+def escribir_registro(f, marca: int, pwm: int, rpm: int) -> None:
     """!
-    Incrementa el contador global de flancos.
+    Empaqueta ``marca, pwm, rpm`` como registro binario ``<IBH`` (u32, u8,
+    u16) y lo escribe. El host lo convierte a CSV con
+    ``Control_Analisis_Data.py``.
 
-    @param pin  Objeto :class:`machine.Pin` que disparó la interrupción.
-    @note  Esta función se registra como manejador de interrupción (IRQ) en el
-           flanco de bajada generado cada vez que pasa una ranura del encoder.
+    @param f      Archivo binario abierto.
+    @param marca  Marca de tiempo [ms].
+    @param pwm    Ciclo de trabajo [%].
+    @param rpm    Velocidad [RPM] (entera, < 65536).
     """
-    global contador
-    contador += 1
+    ustruct.pack_into("<IBH", _registro, 0, marca, pwm, rpm)
+    f.write(_registro)
 
 
-# Registro de la rutina de interrupción ─ se hace *después* de definirla.
-sensor_pin.irq(trigger=Pin.IRQ_FALLING, handler=incrementar_contador)
+# Formato de salida elegido una sola vez
+_escribir = escribir_registro if FORMATO_BINARIO else escribir_fila
 
 
-def calcular_rpm() -> float:
+def volcar_muestras(f, hasta: int) -> None:
     """!
-    Calcula las revoluciones por minuto (RPM) en función de los pulsos
-    acumulados desde la última llamada.
+    Escribe en el archivo las muestras del anillo pendientes hasta ``hasta``.
 
-    @return Velocidad instantánea del eje en RPM.
+    La marca de tiempo y la ventana de cada muestra salen del instante real
+    registrado por la ISR, no del índice: un disparo retrasado del
+    temporizador alarga esa ventana en vez de falsear la RPM.
+
+    @param f      Archivo de salida abierto.
+    @param hasta  Índice (exclusivo) de la última muestra a volcar.
     """
-    global contador
-    vueltas = contador / ENCODER_HUECOS
-    rpm = vueltas * (60000 / MEDICION_INTERVALO_MS)
-    contador = 0  # Reinicia el contador para la siguiente ventana
-    return rpm
+    global _n_leidas, _t_anterior_us, _transcurrido_us
+    while _n_leidas < hasta:
+        i = _n_leidas & (TAM_BUFFER - 1)
+        _n_leidas += 1
+        t_us = _marcas[i]
+        ventana = time.ticks_diff(t_us, _t_anterior_us)
+        _t_anterior_us = t_us
+        _transcurrido_us += ventana
+        _escribir(f, (_transcurrido_us + 500) // 1000, _pwms[i],
+                  calcular_rpm(_cuentas[i], ventana))
+
+
+# -----------------------------------------------------------------------------
+# Escritura en el núcleo 1                                                     
+# -----------------------------------------------------------------------------
+
+ESCRITOR_PERIODO_MS = 20     #: Pausa del escritor entre vaciados del anillo [ms]
+
+_fin_captura = False         #: El núcleo 0 terminó de muestrear
+_escritor_activo = False     #: El hilo escritor aún no ha vaciado el anillo
+
+
+def _escritor(f) -> None:
+    """!
+    Hilo del núcleo 1: vacía el anillo al CSV mientras el núcleo 0 mide.
+
+    Productor (ISR) y consumidor sólo comparten ``_n_muestras`` /
+    ``_n_leidas``, que cada lado escribe en exclusiva. El formateo y las
+    llamadas a ``write`` ocurren aquí; durante el borrado/programación de la
+    flash MicroPython detiene también el núcleo 0 y sus IRQ, y el retraso
+    resultante queda reflejado en las marcas reales de cada muestra.
+
+    @param f  Archivo CSV abierto.
+    """
+    global _escritor_activo
+    try:
+        while True:
+            fin = _fin_captura       # Leer antes de vaciar: no se pierde la cola
+            volcar_muestras(f, _n_muestras)
+            if fin:
+                break
+            time.sleep_ms(ESCRITOR_PERIODO_MS)
+    finally:
+        # También ante un error (flash llena, MemoryError): el núcleo 0 no
+        # debe quedarse esperando a un hilo que ya terminó
+        _escritor_activo = False
 
 
 # -----------------------------------------------------------------------------
 # Preparación de archivo                                                       
 # -----------------------------------------------------------------------------
 
-with open(ARCHIVO, "w") as f:
-    f.write("Tiempo_ms,PWM_porcentaje,RPM\n")
+# Se abre una sola vez, en modo binario: las filas ya son bytes ASCII, se
+# acumulan en un bloque preasignado y llegan a la flash por bloques completos,
+# sin abrir/cerrar ni forzar flush por escalón.
+f = EscritorBloques(open(ARCHIVO, "wb"))
+if not FORMATO_BINARIO:
+    f.write(CABECERA_CSV)
 
 # -----------------------------------------------------------------------------
 # Secuencia principal                                                          
 # -----------------------------------------------------------------------------
 
-# Construye la secuencia completa 0→100 % y regreso 100→0 % (sin repetir el 0 %)
-secuencia_pwm = PASOS_PWM + PASOS_PWM[::-1][1:]
-
-tiempo_inicio = time.ticks_ms()
-
-for porcentaje in secuencia_pwm:
-    # ---------------------------------------------------------------------
-    # Aplicar nuevo valor de PWM                                           
-    # ---------------------------------------------------------------------
-    duty = int(65535 * porcentaje / 100)
-    pwm_pin.duty_u16(duty)
-    print(f"PWM = {porcentaje}%")
-
-    # Variables para almacenar los datos de este escalón
-    datos_temporales = []
-    tiempo_inicio_paso = time.ticks_ms()
-    ultimo_tiempo_medicion = time.ticks_ms()
-
-    # ---------------------------------------------------------------------
-    # Medición durante la duración del escalón                             
-    # ---------------------------------------------------------------------
-    while time.ticks_diff(time.ticks_ms(), tiempo_inicio_paso) < TIEMPO_ENTRE_PASOS:
-        tiempo_actual = time.ticks_ms()
-        if time.ticks_diff(tiempo_actual, ultimo_tiempo_medicion) >= MEDICION_INTERVALO_MS:
-            rpm = calcular_rpm()
-            marca_tiempo = time.ticks_diff(tiempo_actual, tiempo_inicio)
-            datos_temporales.append((marca_tiempo, porcentaje, rpm))
-            ultimo_tiempo_medicion = tiempo_actual
-
-    # ---------------------------------------------------------------------
-    # Almacenar los datos de este escalón en el archivo CSV                
-    # ---------------------------------------------------------------------
-    with open(ARCHIVO, "a") as f:
-        for fila in datos_temporales:
-            f.write("{},{},{}\n".format(*fila))
-        f.flush()  #: Garantiza la escritura inmediata en flash
+# El hardware dispara la ISR cada 4 ms y el núcleo 1 escribe el CSV; el
+# núcleo 0 sólo aplica los escalones
+leer_cuenta()  # descarta los flancos acumulados antes del arranque
+_t_anterior_us = time.ticks_us()  # inicio de la primera ventana
+_escritor_activo = True
+_thread.start_new_thread(_escritor, (f,))
+sample_tmr = Timer()
+sample_tmr.init(freq=1000 // MEDICION_INTERVALO_MS, mode=Timer.PERIODIC,
+                callback=_on_sample_tick, hard=True)
+
+gc.disable()  # Sin recolecciones automáticas durante la adquisición
+try:
+    # Secuencia completa 0→100 % y regreso 100→0 % (sin repetir el 100 %)
+    for porcentaje in barrido(PASO_PWM):
+        gc.collect()  # Recolección determinista entre escalones
+        # ---------------------------------------------------------------------
+        # Aplicar nuevo valor de PWM                                           
+        # ---------------------------------------------------------------------
+        pwm_pin.duty_u16(DUTY[porcentaje])
+        pwm_actual = porcentaje  # Etiqueta las muestras siguientes
+        print(f"PWM = {porcentaje}%")
+
+        time.sleep_ms(TIEMPO_ENTRE_PASOS)
+finally:
+    pwm_pin.duty_u16(0)  # Apaga la señal PWM también ante Ctrl‑C o error
+    sample_tmr.deinit()
+    gc.enable()
+    _fin_captura = True
+    while _escritor_activo:  # Espera a que el núcleo 1 vacíe el anillo
+        time.sleep_ms(ESCRITOR_PERIODO_MS)
+    f.close()  # Escribe el último bloque parcial y cierra el archivo
 
 # -----------------------------------------------------------------------------
 # Finalización                                                                 
 # -----------------------------------------------------------------------------
 
-pwm_pin.duty_u16(0)  # Apaga la señal PWM
 print("Caracterización finalizada. Datos guardados en flash.")
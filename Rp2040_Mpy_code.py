@@ -17,6 +17,7 @@
  *   - `START <paso>`  Inicia la captura automática con incrementos de <paso> %.
  *   - `PWM <valor>`   Activa el modo manual con un PWM constante (0–100 %).
  *   - `EXIT`          Detiene el PWM y sale.
+ *   - `q`             Durante la captura o el modo manual, los detiene.
  *
  * @author  Miguel Angel Alvarez Guzman
  * @date    2025‑05‑04
@@ -24,36 +25,45 @@
 """
 
 # =================== IMPORTS ===================
-from machine import Pin, PWM, Timer  # Hardware‑specific clases de MicroPython
+from machine import Pin              # Hardware‑specific clases de MicroPython
 import time                          # Temporización (µs / ms)
+import micropython                   # Emisor Viper para la ISR
+from micropython import const        # Constantes resueltas al compilar
 import sys, uos, math                # utils varios
+import gc                            # Recolección manual entre escalones
+import uselect                       # Consulta no bloqueante de la consola
+from array import array              # Búferes preasignados de muestras
+from encoder_common import (ENCODER_HUECOS, CABECERA_CSV,  # Parte común
+                            EscritorBloques,
+                            pwm_pin, sensor_pin, DUTY, linea, mv_linea,
+                            itoa, barrido)
 
 # =================== PARAMETROS GENERALES ===================
 # --- Disco encoder ---
-ENCODER_HUECOS      = 20                           
 SECTORS_REV         = ENCODER_HUECOS * 2          
 RPM_CONST_US        = 60_000_000 // SECTORS_REV    
-MIN_DT_US           = 100                          
+MIN_DT_US           = const(100)                   
+TIMERAWL            = const(0x40054028)  # Contador crudo de 1 µs (32 bits bajos)
 
 # --- PWM / escalones ---
-PWM_FREQ_HZ         = 100_000                     
 TIEMPO_ENTRE_ESCALONES = 2_000                     
 REPORT_INTERVALO_MS = 500                       
-
-# =================== HARDWARE ===================
-pwm_pin = PWM(Pin(3))              # Pin GP3 → PWM (canal por defecto)
-pwm_pin.freq(PWM_FREQ_HZ)
-
-sensor_pin = Pin(5, Pin.IN, Pin.PULL_UP)  # GP5 ← sensor óptico
+REPORTES_POR_LOTE   = 4            # Reportes por escritura a consola (2 s)
+MUESTREO_MS         = 4            # Periodo de registro CSV (ms)
+N_MUESTRAS          = TIEMPO_ENTRE_ESCALONES // MUESTREO_MS  # Muestras por escalón
 
 # =================== VARIABLES DE ESTADO ===================
-high_start_us: int | None = None   # Momento inicio pulso alto (µs)
-rpm_global: float      = 0.0       # Último valor de RPM calculado
+# Estado de la ISR en un array de 32 bits: Viper lo escribe sin crear enteros
+_INICIO = const(0)                 # Momento inicio pulso alto (µs)
+_SUBIDA = const(1)                 # 1 → se vio la subida del pulso actual
+_DT     = const(2)                 # Último ancho de pulso alto válido (µs)
+_estado = array('i', [0, 0, 0])
 modo_captura: bool     = False     # True → capturando CSV
 pwm_manual:  int       = 0         # Ciclo PWM actual en modo manual (0‑100)
 
 # =================== ISR: mide SOLO el tiempo en alto ===================
-def medir_pulso(pin: Pin) -> None:
+@micropython.viper
+def medir_pulso(pin):
     """
     /**
      * @brief  Interrupción en flancos del sensor.
@@ -61,39 +71,156 @@ def medir_pulso(pin: Pin) -> None:
      *  * **Flanco de subida (LOW→HIGH)**: almacena el instante en que empieza
      *    el sector opaco (pulso alto).
      *  * **Flanco de bajada (HIGH→LOW)**: computa la duración del pulso alto
-     *    (∆t) y, si supera el antirrebote, actualiza la variable global
-     *    `rpm_global` con el valor de RPM correspondiente.
+     *    (∆t) y, si supera el antirrebote, la guarda en `_estado[_DT]`.
+     *
+     * Se registra como IRQ *hard*. Compilada con Viper, lee el registro
+     * `TIMERAWL` del temporizador directamente (sin `ticks_us` ni
+     * `ticks_diff`) y opera con enteros de máquina sobre `_estado`, así que
+     * no reserva memoria. La resta de 32 bits absorbe el desbordamiento del
+     * contador. La conversión a RPM la hace @c rpm_actual fuera de la
+     * interrupción.
      *
      * @param pin  Objeto `machine.Pin` que generó la interrupción.
-     * @note       Se asume que el disco tiene @c SECTORS_REV sectores por
-     *             revolución, de modo que un pulso corresponde a 1 /
-     *             `SECTORS_REV` de vuelta.
      */
     """
-    global high_start_us, rpm_global
+    e = ptr32(_estado)
+    ahora = ptr32(TIMERAWL)[0]
 
-    ahora = time.ticks_us()
-
-    if pin.value():                      # LOW → HIGH
-        high_start_us = ahora           # Marca inicio de pulso alto
+    if int(pin.value()):                # LOW → HIGH
+        e[_INICIO] = ahora              # Marca inicio de pulso alto
+        e[_SUBIDA] = 1
         return
 
     # Aquí sólo entra en HIGH → LOW
-    if high_start_us is None:
+    if e[_SUBIDA] == 0:
         return                          # Subida perdida ⇒ descarta medición
+    e[_SUBIDA] = 0                      # Prepara siguiente ciclo
 
-    dt = time.ticks_diff(ahora, high_start_us)
-    high_start_us = None                # Prepara siguiente ciclo
-
+    dt = ahora - e[_INICIO]
     if dt < MIN_DT_US:                  # Filtra rebotes / ruido
         return
 
-    rpm_global = RPM_CONST_US / dt      # Convierte µs ⇒ RPM
+    e[_DT] = dt                         # La conversión a RPM se difiere
 
 
-# Asocia ambos flancos a la ISR
+# Asocia ambos flancos a la ISR (hard: sin pasar por micropython.schedule)
 sensor_pin.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING,
-               handler=medir_pulso)
+               handler=medir_pulso, hard=True)
+
+
+def rpm_actual() -> float:
+    """
+    /**
+     * @brief  Convierte el último ancho de pulso medido por la ISR en RPM.
+     *
+     * @return RPM correspondientes a `_estado[_DT]` (0 si aún no hay medida).
+     */
+    """
+    dt = _estado[_DT]
+    return RPM_CONST_US / dt if dt else 0.0
+
+# =================== CONSOLA NO BLOQUEANTE ===================
+_poller = uselect.poll()
+_poller.register(sys.stdin, uselect.POLLIN)
+
+def _tecla_salida() -> bool:
+    """
+    /**
+     * @brief  Indica, sin bloquear, si el usuario escribió `q` en consola.
+     *
+     * Usa `ipoll(0)`, que no reserva memoria cuando no hay datos pendientes.
+     */
+    """
+    for _ in _poller.ipoll(0):
+        c = sys.stdin.read(1)
+        return c == "q" or c == "Q"     # '' (sin dato) no cuenta como 'q'
+    return False
+
+# =================== CSV SIN ASIGNACIONES ===================
+def escribir_fila(f, marca: int, pwm_val: int, dt: int) -> None:
+    """
+    /**
+     * @brief  Compone `marca,pwm,rpm\n` en el búfer compartido y lo escribe
+     *         en @p f.
+     *
+     * La RPM (`RPM_CONST_US / dt`) se calcula con división entera y se
+     * escribe con 3 decimales redondeados, sin pasar por `float`.
+     *
+     * @param dt  Ancho de pulso alto (µs); 0 → sin medida (RPM = 0).
+     */
+    """
+    if dt:
+        q, resto = divmod(RPM_CONST_US, dt)
+        frac = (resto * 1000 + dt // 2) // dt   # Milésimas, redondeado
+        if frac == 1000:                         # El redondeo acarrea
+            q += 1
+            frac = 0
+    else:
+        q = frac = 0
+    n = itoa(linea, 0, marca)
+    linea[n] = 44                      # ','
+    n = itoa(linea, n + 1, pwm_val)
+    linea[n] = 44
+    n = itoa(linea, n + 1, q)
+    linea[n] = 46                      # '.'
+    n = itoa(linea, n + 1, frac, 3)
+    linea[n] = 10                      # '\n'
+    f.write(mv_linea[:n + 1])
+
+# =================== BÚFERES DE ESCALÓN (SoA) ===================
+# Columnas paralelas preasignadas: durante el escalón sólo se escriben
+# enteros en ellas; el PWM es constante y la división a RPM se hace al volcar.
+_t_buf  = array('I', [0] * N_MUESTRAS)  # Marca de tiempo de cada muestra (ms)
+_dt_buf = array('I', [0] * N_MUESTRAS)  # Ancho de pulso vigente (µs, 0 = sin dato)
+_n_volcadas = 0                          # Muestras del escalón ya escritas
+
+def _volcar_escalon(f, n: int, pwm_val: int) -> None:
+    """
+    /**
+     * @brief  Escribe en @p f las muestras de los búferes aún no escritas,
+     *         hasta la @p n‑ésima.
+     *
+     * `_n_volcadas` avanza antes de escribir cada fila: si un Ctrl‑C corta
+     * el volcado, una nueva llamada continúa donde quedó sin duplicar filas
+     * (a lo sumo se pierde la fila que se estaba escribiendo).
+     *
+     * @param f        Archivo CSV abierto.
+     * @param n        Número de muestras válidas en `_t_buf` / `_dt_buf`.
+     * @param pwm_val  Ciclo de trabajo aplicado durante el escalón (%).
+     */
+    """
+    global _n_volcadas
+    try:
+        while _n_volcadas < n:
+            k = _n_volcadas
+            _n_volcadas = k + 1
+            escribir_fila(f, _t_buf[k], pwm_val, _dt_buf[k])
+    except Exception as e:
+        print("Error al escribir CSV:", e)
+        raise
+
+# =================== REPORTES DE CONSOLA POR LOTES ===================
+_informe = bytearray(40 * REPORTES_POR_LOTE)  # Líneas `PWM=..%  |  RPM=..` pendientes
+_mv_informe = memoryview(_informe)
+
+def _agregar_reporte(pos: int, pwm_val: int, rpm: float) -> int:
+    """
+    /**
+     * @brief  Añade `PWM=<pwm>%  |  RPM=<rpm>\n` (RPM con 2 decimales) al
+     *         búfer de reportes a partir de @p pos.
+     *
+     * @return Índice siguiente al final de la línea.
+     */
+    """
+    r = int(rpm * 100 + 0.5)           # RPM en centésimas, redondeado
+    _informe[pos:pos + 4] = b"PWM="
+    n = itoa(_informe, pos + 4, pwm_val)
+    _informe[n:n + 10] = b"%  |  RPM="
+    n = itoa(_informe, n + 10, r // 100)
+    _informe[n] = 46                   # '.'
+    n = itoa(_informe, n + 1, r % 100, 2)
+    _informe[n] = 10                   # '\n'
+    return n + 1
 
 # =================== MODOS DE FUNCIONAMIENTO ===================
 def ejecutar_captura(paso_pwm: int) -> None:
@@ -109,44 +236,61 @@ def ejecutar_captura(paso_pwm: int) -> None:
      * @param paso_pwm  Incremento/decremento porcentual (1–99).
      */
     """
-    global modo_captura
+    global modo_captura, _n_volcadas
     modo_captura = True
 
-    pwm_max = 100
-    secuencia = (list(range(0, pwm_max + 1, paso_pwm)) +
-                 list(range(pwm_max - paso_pwm, -1, -paso_pwm)))
-
     # ---------- Creación de archivo ----------
     nombre = f"captura_{time.ticks_ms()}.csv"
     try:
-        f = open(nombre, "w")
-        f.write("Tiempo_ms,PWM_porcentaje,RPM\n")
+        f = EscritorBloques(open(nombre, "wb"))  # Binario, bloques de flash
+        f.write(CABECERA_CSV)
     except Exception as e:
         print("Error al crear archivo:", e)
         modo_captura = False
         return
 
-    print("Iniciando captura…  (Ctrl‑C para abortar)")
-    inicio = time.ticks_ms()
+    # Funciones de reloj ligadas como locales (búsqueda más rápida en el bucle)
+    ticks_ms, ticks_diff = time.ticks_ms, time.ticks_diff
+    ticks_add, sleep_ms = time.ticks_add, time.sleep_ms
+
+    print("Iniciando captura…  ('q' o Ctrl‑C para abortar)")
+    inicio = ticks_ms()
+    n = 0                                # Muestras tomadas en el escalón actual
+    _n_volcadas = 0
+    pwm_val = 0                          # Definido aunque el Ctrl‑C llegue antes
 
+    gc.disable()                         # Sin recolecciones durante la medición
     try:
         # ---------- Bucle principal ----------
-        for pwm_val in secuencia:
-            pwm_pin.duty_u16(int(65535 * pwm_val / 100))
+        for pwm_val in barrido(paso_pwm):
+            gc.collect()                 # Recolección determinista entre escalones
+            pwm_pin.duty_u16(DUTY[pwm_val])
             print(f"PWM aplicado: {pwm_val}%")
 
-            t0 = time.ticks_ms()
-            while time.ticks_diff(time.ticks_ms(), t0) < TIEMPO_ENTRE_ESCALONES:
-                time.sleep_ms(4)
-                marca = time.ticks_diff(time.ticks_ms(), inicio)
-                try:
-                    f.write(f"{marca},{pwm_val},{rpm_global:.4f}\n")
-                except Exception as e:
-                    print("Error al escribir CSV:", e)
-                    raise
+            t0 = ahora = ticks_ms()
+            proxima = t0                 # Instante de la siguiente muestra
+            while n < N_MUESTRAS and ticks_diff(ahora, t0) < TIEMPO_ENTRE_ESCALONES:
+                # Un único sleep hasta la siguiente muestra (sin deriva)
+                proxima = ticks_add(proxima, MUESTREO_MS)
+                espera = ticks_diff(proxima, ahora)
+                if espera > 0:
+                    sleep_ms(espera)
+                ahora = ticks_ms()       # Única lectura del reloj por muestra
+                _t_buf[n] = ticks_diff(ahora, inicio)
+                _dt_buf[n] = _estado[_DT]
+                n += 1
+                if _tecla_salida():
+                    raise KeyboardInterrupt  # misma salida que Ctrl‑C
+
+            # ---------- Volcado del escalón completo ----------
+            _volcar_escalon(f, n, pwm_val)
+            n = 0                        # Primero n: un corte aquí no reescribe
+            _n_volcadas = 0
     except KeyboardInterrupt:
+        _volcar_escalon(f, n, pwm_val)   # Sólo las filas que faltan del escalón
         print("Captura interrumpida por usuario.")
     finally:
+        gc.enable()
         pwm_pin.duty_u16(0)
         modo_captura = False
         f.close()
@@ -158,62 +302,105 @@ def modo_manual(pwm_val: int) -> None:
      * @brief  Modo manual: aplica un PWM fijo y muestra la RPM periódicamente.
      *
      * @param pwm_val  Ciclo de trabajo en porcentaje (0–100 %).
-     * @note  Presione **Ctrl‑C** para salir y desactivar el PWM.
+     * @note  Escriba **q** o presione **Ctrl‑C** para salir y desactivar
+     *        el PWM. Entre reportes la CPU duerme en lugar de sondear.
+     *        Los reportes se envían en lotes de `REPORTES_POR_LOTE`, con
+     *        una sola escritura USB‑CDC por lote.
      */
     """
     global pwm_manual
     pwm_manual = pwm_val
-    pwm_pin.duty_u16(int(65535 * pwm_val / 100))
+    pwm_pin.duty_u16(DUTY[pwm_val])
 
-    print(f"PWM manual {pwm_val}% activo — Ctrl‑C para salir")
-    ultimo = time.ticks_ms()
+    print(f"PWM manual {pwm_val}% activo — 'q' o Ctrl‑C para salir")
 
+    pos = 0                              # Bytes pendientes en `_informe`
+    pendientes = 0                       # Reportes en el lote actual
     try:
-        while True:
-            actual = time.ticks_ms()
-            if time.ticks_diff(actual, ultimo) >= REPORT_INTERVALO_MS:
-                print(f"PWM={pwm_manual}%  |  RPM={rpm_global:.2f}")
-                ultimo = actual
+        while not _tecla_salida():
+            time.sleep_ms(REPORT_INTERVALO_MS)
+            pos = _agregar_reporte(pos, pwm_manual, rpm_actual())
+            pendientes += 1
+            if pendientes == REPORTES_POR_LOTE:
+                sys.stdout.buffer.write(_mv_informe[:pos])
+                pos = pendientes = 0
     except KeyboardInterrupt:
-        print("Modo manual interrumpido.")
-        pwm_pin.duty_u16(0)
-        pwm_manual = 0
+        pass
+    if pos:
+        sys.stdout.buffer.write(_mv_informe[:pos])  # Lote incompleto
+    print("Modo manual interrumpido.")
+    pwm_pin.duty_u16(0)
+    pwm_manual = 0
+
+# =================== COMANDOS DE CONSOLA ===================
+def _cmd_exit(partes: list) -> bool:
+    """
+    /**
+     * @brief  `EXIT`: apaga el PWM y pide salir del bucle de consola.
+     *
+     * @return True → terminar el bucle.
+     */
+    """
+    print("Saliendo…")
+    pwm_pin.duty_u16(0)
+    return True
+
+def _cmd_start(partes: list) -> bool:
+    """
+    /**
+     * @brief  `START <paso>`: valida el paso e inicia la captura automática.
+     */
+    """
+    if len(partes) == 2 and partes[1].isdigit():
+        paso = int(partes[1])
+        if 1 <= paso < 100:
+            ejecutar_captura(paso)
+        else:
+            print("ERROR: paso 1‑99")
+    else:
+        print("Uso: START <paso>")
+    return False
+
+def _cmd_pwm(partes: list) -> bool:
+    """
+    /**
+     * @brief  `PWM <valor>`: valida el ciclo de trabajo y entra en modo manual.
+     */
+    """
+    if len(partes) == 2 and partes[1].isdigit():
+        val = int(partes[1])
+        if 0 <= val <= 100:
+            modo_manual(val)
+        else:
+            print("ERROR: PWM 0‑100")
+    else:
+        print("Uso: PWM <valor>")
+    return False
+
+def _cmd_desconocido(partes: list) -> bool:
+    """
+    /**
+     * @brief  Respuesta para cualquier primer token no registrado.
+     */
+    """
+    print("Comando no reconocido.")
+    return False
+
+# Primer token (en mayúsculas) → manejador
+COMANDOS = {"EXIT": _cmd_exit, "START": _cmd_start, "PWM": _cmd_pwm}
 
 # =================== BUCLE DE CONSOLA ===================
 print("Sistema listo. Comandos:  START <paso>  |  PWM <valor>  |  EXIT")
 
 while True:
     try:
-        cmd = input(">> ").strip()
-        if cmd.upper() == "EXIT":
-            print("Saliendo…")
-            pwm_pin.duty_u16(0)
-            break
-
-        elif cmd.upper().startswith("START"):
-            partes = cmd.split()
-            if len(partes) == 2 and partes[1].isdigit():
-                paso = int(partes[1])
-                if 1 <= paso < 100:
-                    ejecutar_captura(paso)
-                else:
-                    print("ERROR: paso 1‑99")
-            else:
-                print("Uso: START <paso>")
-
-        elif cmd.upper().startswith("PWM"):
-            partes = cmd.split()
-            if len(partes) == 2 and partes[1].isdigit():
-                val = int(partes[1])
-                if 0 <= val <= 100:
-                    modo_manual(val)
-                else:
-                    print("ERROR: PWM 0‑100")
-            else:
-                print("Uso: PWM <valor>")
+        partes = input(">> ").split()
+        if not partes:
+            continue                     # línea vacía (p. ej. tras una 'q')
 
-        else:
-            print("Comando no reconocido.")
+        # Un único split y un único upper() por línea
+        if COMANDOS.get(partes[0].upper(), _cmd_desconocido)(partes):
+            break
 
     except KeyboardInterrupt:
         print("\nInterrumpido; puedes volver a escribir un comando.")
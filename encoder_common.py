@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+/**
+ * @file    encoder_common.py
+ * @brief   Elementos compartidos por los registradores de RPM del RP2040.
+ *
+ * Reúne lo que @c First_Code_Mpy.py y @c Rp2040_Mpy_code.py tenían
+ * duplicado:
+ *   - Parámetros del disco encoder y de la señal PWM.
+ *   - Inicialización de los pines PWM (GP3) y del sensor óptico (GP5).
+ *   - Cabecera CSV y formateo de enteros en ASCII sobre un búfer reutilizado.
+ *   - Escritura a la flash por bloques completos del sistema de archivos.
+ *
+ * La medición de RPM (contador PIO o ancho de pulso por IRQ) sigue en cada
+ * script. El módulo está pensado para congelarse en el firmware mediante
+ * @c manifest.py, de modo que se ejecute desde la flash sin compilarse al
+ * importarlo.
+ *
+ * @author  Miguel Ángel Álvarez Guzmán
+ * @date    2025‑05‑06
+ */
+"""
+
+from machine import Pin, PWM, mem32
+from array import array
+import uos
+
+# -----------------------------------------------------------------------------
+# Parámetros de configuración
+# -----------------------------------------------------------------------------
+
+ENCODER_HUECOS = 20          #: Número de ranuras/reflectores del disco encoder
+PWM_FREQ_HZ = 100_000        #: Frecuencia de la señal PWM [Hz]
+PIN_PWM = 3                  #: GPIO de salida PWM hacia el puente H
+PIN_SENSOR = 5               #: GPIO de entrada del fotointerruptor
+
+PADS_BANK0 = 0x4001C000      #: Base de los registros de pads GPIO del RP2040
+PAD_SCHMITT = 1 << 1         #: Bit SCHMITT de GPIOx_CTRL (histéresis de entrada)
+
+CABECERA_CSV = b"Tiempo_ms,PWM_porcentaje,RPM\n"  #: Primera línea de cada CSV
+
+#: Tamaño de bloque del sistema de archivos de la flash (4096 B en LittleFS
+#: del RP2040); @c EscritorBloques entrega los datos en bloques de este tamaño.
+TAM_BLOQUE = uos.statvfs("/")[0]
+
+# -----------------------------------------------------------------------------
+# Inicialización de hardware
+# -----------------------------------------------------------------------------
+
+pwm_pin = PWM(Pin(PIN_PWM))  # Pin PWM conectado al puente H / transistor de potencia
+pwm_pin.freq(PWM_FREQ_HZ)
+
+sensor_pin = Pin(PIN_SENSOR, Pin.IN, Pin.PULL_UP)  # Entrada del fotointerruptor
+# Fuerza el disparador Schmitt del pad: la histéresis elimina los rebotes
+# lentos del fotointerruptor antes de que lleguen al PIO o a la IRQ.
+mem32[PADS_BANK0 + 0x04 + PIN_SENSOR * 4] |= PAD_SCHMITT
+
+#: Tabla ciclo de trabajo [%] → valor ``duty_u16``, precalculada con enteros
+DUTY = array('H', [(p * 65535) // 100 for p in range(101)])
+
+# -----------------------------------------------------------------------------
+# Formato CSV sin asignaciones
+# -----------------------------------------------------------------------------
+
+linea = bytearray(48)          #: Búfer reutilizado para componer cada fila CSV
+mv_linea = memoryview(linea)   #: Vista sobre el búfer para escribir sólo n bytes
+
+
+def itoa(buf, pos: int, valor: int, ancho: int = 1) -> int:
+    """!
+    Escribe un entero no negativo en ASCII dentro de un búfer, sin crear
+    objetos ``str``.
+
+    @param buf    ``bytearray`` destino.
+    @param pos    Índice donde empieza el número.
+    @param valor  Entero a escribir (≥ 0).
+    @param ancho  Número mínimo de dígitos (rellena con ceros a la izquierda).
+    @return Índice siguiente al último dígito escrito.
+    """
+    fin = pos
+    while valor or fin - pos < ancho:
+        buf[fin] = 48 + valor % 10   # '0' + dígito, en orden inverso
+        valor //= 10
+        fin += 1
+    i, j = pos, fin - 1
+    while i < j:                     # invierte los dígitos en sitio
+        buf[i], buf[j] = buf[j], buf[i]
+        i += 1
+        j -= 1
+    return fin
+
+
+# -----------------------------------------------------------------------------
+# Secuencia de PWM
+# -----------------------------------------------------------------------------
+
+def barrido(paso: int, pwm_max: int = 100):
+    """!
+    Genera la secuencia de escalones 0 → ``pwm_max`` → 0 % sin repetir el
+    máximo y sin materializar listas intermedias.
+
+    @param paso     Incremento/decremento porcentual entre escalones.
+    @param pwm_max  Ciclo de trabajo máximo [%].
+    @return Generador de ciclos de trabajo [%].
+    """
+    yield from range(0, pwm_max + 1, paso)
+    yield from range(pwm_max - paso, -1, -paso)
+
+
+# -----------------------------------------------------------------------------
+# Escritura por bloques
+# -----------------------------------------------------------------------------
+
+class EscritorBloques:
+    """!
+    Envoltura de un archivo que acumula lo escrito en un ``bytearray``
+    preasignado de ``TAM_BLOQUE`` bytes y sólo llama a ``f.write`` con
+    bloques completos.
+
+    El argumento ``buffering`` de ``open()`` no llega al controlador
+    LittleFS de MicroPython, así que el agrupamiento se hace aquí: cada
+    ``write`` al archivo programa un bloque entero de la flash, salvo el
+    último, que se vuelca al cerrar.
+    """
+
+    def __init__(self, f, tam: int = TAM_BLOQUE):
+        """!
+        @param f    Archivo abierto en modo binario.
+        @param tam  Tamaño del bloque [bytes].
+        """
+        self._f = f
+        self._buf = bytearray(tam)
+        self._tam = tam
+        self._n = 0
+
+    def write(self, datos) -> None:
+        """!
+        Añade @p datos al bloque en curso; al completarlo lo escribe y
+        continúa con el resto en un bloque nuevo.
+
+        @param datos  Bytes a escribir (a lo sumo ``tam`` bytes: una fila o
+                      un registro).
+        """
+        n = self._n
+        l = len(datos)
+        libre = self._tam - n
+        if l < libre:
+            self._buf[n:n + l] = datos
+            self._n = n + l
+            return
+        self._buf[n:] = datos[:libre]
+        self._f.write(self._buf)
+        resto = l - libre
+        self._buf[:resto] = datos[libre:]
+        self._n = resto
+
+    def close(self) -> None:
+        """!
+        Escribe el bloque parcial pendiente y cierra el archivo.
+        """
+        if self._n:
+            self._f.write(memoryview(self._buf)[:self._n])
+            self._n = 0
+        self._f.close()
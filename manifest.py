@@ -0,0 +1,11 @@
+# Manifiesto de módulos congelados para el firmware MicroPython del RP2040.
+#
+# Compilar el puerto con:
+#   make -C ports/rp2 BOARD=RPI_PICO FROZEN_MANIFEST=<ruta>/manifest.py
+#
+# encoder_common se precompila con mpy-cross -O3 (sin asserts ni docstrings)
+# y se ejecuta desde la flash, sin compilarse ni ocupar heap al importarlo.
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("encoder_common.py", opt=3)